@@ -1,30 +1,31 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Form
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import models, database, utils, schemas
+import asyncio
+import time
 
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
-
-# Dependency for DB session
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Verified against when the email is unknown; computed once at import, which also
+# warms up bcrypt before the first real login
+_hash_started = time.perf_counter()
+_DUMMY_HASH = utils.hash_password("dummy-password-never-matches")
+# Retune BCRYPT_ROUNDS per deployment so this stays roughly in the 80-250ms band
+print(f"bcrypt cost {utils.BCRYPT_ROUNDS}: hash_password took {(time.perf_counter() - _hash_started) * 1000:.0f}ms")
 
 
 @router.post("/register", response_model=schemas.BaseResponse[dict])
-def register(
+async def register(
     email: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     try:
         # Validate email format
         if not utils.is_valid_email(email):
-            return schemas.BaseResponse(
+            return schemas.BaseResponse.model_construct(
                 success=False,
                 message="Invalid email format",
                 data=None
@@ -32,30 +33,31 @@ def register(
         
         # Validate password strength
         if len(password) < 6:
-            return schemas.BaseResponse(
+            return schemas.BaseResponse.model_construct(
                 success=False,
                 message="Password must be at least 6 characters long",
                 data=None
             )
 
-        existing_user = db.query(models.User).filter(models.User.email == email).first()
+        existing_user = await db.scalar(select(models.User).where(models.User.email == email))
         if existing_user:
-            return schemas.BaseResponse(
+            return schemas.BaseResponse.model_construct(
                 success=False,
                 message="Email already registered",
                 data=None
             )
 
-        hashed_pw = utils.hash_password(password)
+        loop = asyncio.get_running_loop()
+        hashed_pw = await loop.run_in_executor(utils.crypto_executor, utils.hash_password, password)
         new_user = models.User(email=email, hashed_password=hashed_pw)
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
         
         # Create access token for the new user
         access_token = utils.create_access_token(data={"sub": new_user.email})
         
-        return schemas.BaseResponse(
+        return schemas.BaseResponse.model_construct(
             success=True,
             message="User registered successfully",
             data={
@@ -67,42 +69,65 @@ def register(
         )
     
     except Exception as e:
-        db.rollback()
-        return schemas.BaseResponse(
+        await db.rollback()
+        return schemas.BaseResponse.model_construct(
             success=False,
             message=f"Registration failed: {str(e)}",
             data=None
         )
 @router.post("/login", response_model=schemas.BaseResponse[dict])
-def login(
+async def login(
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     try:
-        user = db.query(models.User).filter(models.User.email == username).first()
-        if not user or not utils.verify_password(password, user.hashed_password):
-            return schemas.BaseResponse(
+        user = await db.scalar(select(models.User).where(models.User.email == username))
+        # Always run a bcrypt verify, even for unknown emails, so response time
+        # doesn't reveal whether an account exists
+        loop = asyncio.get_running_loop()
+        password_ok = await loop.run_in_executor(
+            utils.crypto_executor,
+            utils.verify_password,
+            password,
+            user.hashed_password if user else _DUMMY_HASH
+        )
+        if not user or not password_ok:
+            return schemas.BaseResponse.model_construct(
                 success=False,
                 message="Invalid credentials",
                 data=None
             )
 
         access_token = utils.create_access_token(data={"sub": user.email})
+        # Built before the rehash below: a rollback there would expire the user object
+        login_data = {
+            "access_token": access_token, 
+            "token_type": "bearer",
+            "user_id": user.id,
+            "email": user.email
+        }
+
+        # Upgrade hashes made at another cost (e.g. passlib's default 12) to BCRYPT_ROUNDS,
+        # so known and unknown emails end up costing the same as _DUMMY_HASH
+        if utils.needs_rehash(user.hashed_password):
+            try:
+                user.hashed_password = await loop.run_in_executor(
+                    utils.crypto_executor, utils.hash_password, password
+                )
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                print(f"Error rehashing password for user {login_data['user_id']}: {e}")
         
-        return schemas.BaseResponse(
+        return schemas.BaseResponse.model_construct(
             success=True,
             message="Login successful",
-            data={
-                "access_token": access_token, 
-                "token_type": "bearer",
-                "user_id": user.id,
-                "email": user.email
-            }
+            data=login_data
         )
     
     except Exception as e:
-        return schemas.BaseResponse(
+        return schemas.BaseResponse.model_construct(
             success=False,
             message=f"Login failed: {str(e)}",
             data=None
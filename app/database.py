@@ -1,6 +1,6 @@
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import inspect, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
 
@@ -8,7 +8,63 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Map plain URLs from .env onto their async drivers
+ASYNC_DRIVERS = {
+    "sqlite://": "sqlite+aiosqlite://",
+    "postgresql://": "postgresql+asyncpg://",
+    "postgres://": "postgresql+asyncpg://",
+}
+
+def get_async_url(url: str) -> str:
+    for prefix, async_prefix in ASYNC_DRIVERS.items():
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+if DATABASE_URL.startswith("sqlite"):
+    engine = create_async_engine(get_async_url(DATABASE_URL))
+else:
+    # Keep warm connections around and drop dead/stale ones before use
+    engine = create_async_engine(
+        get_async_url(DATABASE_URL),
+        pool_size=int(os.getenv("DB_POOL_SIZE", "20")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "40")),
+        pool_pre_ping=True,
+        pool_recycle=1800,
+    )
+# expire_on_commit=False so committed objects can still be read without
+# an implicit (and in async, illegal) lazy refresh
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
+
+
+def upgrade_schema(conn):
+    """
+    create_all skips tables that already exist, so add any nullable columns and
+    indexes introduced since (e.g. jobs.content_hash and the jobs indexes)
+    """
+    inspector = inspect(conn)
+    quote = conn.dialect.identifier_preparer.quote
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(
+                    f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"
+                ))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+async def init_models():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+
+
+# Dependency: get DB session
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
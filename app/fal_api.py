@@ -2,12 +2,51 @@ import os
 import fal_client
 from fastapi import HTTPException
 import asyncio
-import base64
+import hmac
+from urllib.parse import quote
 
 # Load FAL API key from environment variables
 FAL_API_KEY = os.getenv("FAL_KEY")
 
-async def submit_fal_job(prompt: str, image_bytes: bytes = None) -> dict:
+# One shared client for every FAL call: it keeps a single httpx connection pool,
+# so status/result polls reuse keep-alive connections instead of new TLS handshakes
+FAL_TIMEOUT = float(os.getenv("FAL_TIMEOUT", "120"))
+fal_async_client = fal_client.AsyncClient(key=FAL_API_KEY, default_timeout=FAL_TIMEOUT)
+# Seconds between status checks while waiting on a job (same cadence as the old poller)
+FAL_STATUS_INTERVAL = 5.0
+
+# Public URL of this API that FAL can reach for job webhooks.
+# When unset (e.g. local development) jobs are polled in the background instead.
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+def webhooks_enabled() -> bool:
+    return bool(WEBHOOK_BASE_URL and WEBHOOK_SECRET)
+
+def verify_webhook_token(token: str) -> bool:
+    """
+    Check the shared secret FAL echoes back on the callback URL
+    """
+    if not webhooks_enabled() or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), WEBHOOK_SECRET.encode("utf-8"))
+
+async def upload_image(image_bytes: bytes, content_type: str = "image/jpeg") -> str:
+    """
+    Upload raw image bytes to FAL storage once and return the hosted URL
+    """
+    if not FAL_API_KEY:
+        raise HTTPException(status_code=500, detail="FAL API key not configured")
+
+    try:
+        return await fal_async_client.upload(image_bytes, content_type)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to upload image to AI service: {str(e)}"
+        )
+
+async def submit_fal_job(prompt: str, image_url: str = None) -> dict:
     """
     Submit a job to FAL AI and return request_id immediately
     The actual processing happens asynchronously
@@ -17,16 +56,13 @@ async def submit_fal_job(prompt: str, image_bytes: bytes = None) -> dict:
     
     try:
         # Determine which endpoint to use based on whether image is provided
-        if image_bytes:
+        if image_url:
             # Image-to-image: use Nano Banana Edit
             endpoint = "fal-ai/nano-banana/edit"
             
-            # Convert image to base64
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-            
             arguments = {
                 "prompt": prompt,
-                "image_urls": [f"data:image/jpeg;base64,{image_base64}"],
+                "image_urls": [image_url],
                 "num_images": 1,
                 "output_format": "jpeg"
             }
@@ -41,14 +77,19 @@ async def submit_fal_job(prompt: str, image_bytes: bytes = None) -> dict:
                 "aspect_ratio": "1:1"
             }
         
+        webhook_url = None
+        if webhooks_enabled():
+            webhook_url = f"{WEBHOOK_BASE_URL.rstrip('/')}/api/jobs/callback?token={quote(WEBHOOK_SECRET)}"
+
         # Submit the job to FAL AI - this returns immediately with request_id
-        handler = fal_client.submit(endpoint, arguments=arguments)
+        handler = await fal_async_client.submit(endpoint, arguments=arguments, webhook_url=webhook_url)
         
         # Return immediately with request_id - processing happens in background
         return {
             "request_id": handler.request_id,
             "status": "submitted",
-            "application": endpoint
+            "application": endpoint,
+            "webhook": webhook_url is not None
         }
         
     except Exception as e:
@@ -57,6 +98,76 @@ async def submit_fal_job(prompt: str, image_bytes: bytes = None) -> dict:
             detail=f"Failed to submit job to AI service: {str(e)}"
         )
 
+def _result_response(result: dict) -> dict:
+    """
+    Shape a finished FAL result the same way check_job_status does
+    """
+    result_url = result.get("images", [{}])[0].get("url") if result.get("images") else None
+    return {
+        "status": "completed" if result_url else "failed",
+        "result_url": result_url,
+        "description": result.get("description", ""),
+        "result_data": result
+    }
+
+def parse_webhook_result(payload: dict) -> dict:
+    """
+    Convert a FAL webhook body into the same shape check_job_status returns
+    """
+    if payload.get("status") != "OK":
+        return {
+            "status": "failed",
+            "result_url": None,
+            "error": payload.get("error") or "Job failed"
+        }
+
+    return _result_response(payload.get("payload") or {})
+
+async def wait_for_job(request_id: str, application: str) -> dict:
+    """
+    Wait until a submitted job finishes and return its result in one await.
+    Same mechanism as fal_client.subscribe_async, but for a job that was
+    already submitted (so its request_id could be stored right away).
+    """
+    # Status errors (network blips, 5xx) are retried until the caller's timeout;
+    # only a job FAL reports as completed can end up failed here
+    while True:
+        try:
+            handle = await fal_async_client.get_handle(application, request_id)
+            async for _ in handle.iter_events(interval=FAL_STATUS_INTERVAL):
+                pass
+            break
+        except Exception as e:
+            print(f"Error waiting for job {request_id}, retrying: {str(e)}")
+            await asyncio.sleep(FAL_STATUS_INTERVAL)
+
+    try:
+        result = await fal_async_client.result(application, request_id)
+    except Exception as e:
+        return {
+            "status": "failed",  # Status says completed but can't get result
+            "result_url": None,
+            "error": f"Job marked as completed but result unavailable: {str(e)}"
+        }
+
+    return _result_response(result)
+
+# Responses for FAL statuses that don't require fetching the result
+_STATUS_RESPONSES = {
+    fal_client.InProgress: {
+        "status": "processing",
+        "message": "Job is currently being processed"
+    },
+    fal_client.Queued: {
+        "status": "queued",
+        "message": "Job is in queue waiting to start"
+    },
+}
+_PENDING_RESPONSE = {
+    "status": "pending",
+    "message": "Job status: pending"
+}
+
 async def check_job_status(request_id: str,application:str) -> dict:
     """
     Check the status of a submitted job and get result if completed
@@ -66,14 +177,14 @@ async def check_job_status(request_id: str,application:str) -> dict:
 
     try:
         # First, check the status using the status method
-        current_status = fal_client.status(application,request_id)
+        current_status = await fal_async_client.status(application, request_id)
         
-        if current_status.__class__ == fal_client.Completed:
+        if type(current_status) is fal_client.Completed:
             
             # Job is completed, get the result
             try:
           
-                result = fal_client.result(application,request_id)
+                result = await fal_async_client.result(application, request_id)
 
                 return {
                     "status": "completed",
@@ -87,29 +198,15 @@ async def check_job_status(request_id: str,application:str) -> dict:
                     "result_url": None,
                     "error": f"Job marked as completed but result unavailable: {str(result_error)}"
                 }
-                
-        elif current_status.__class__ == fal_client.InProgress:
-            return {
-                "status": "processing",
-                "message": "Job is currently being processed"
-            }
 
-        elif current_status.__class__ == fal_client.Queued:
-            return {
-                "status": "queued",
-                "message": "Job is in queue waiting to start"
-            }
-        else:
-            return {
-                "status": "pending",
-                "message": f"Job status: pending"
-            }
+        # Copy so callers can't mutate the shared templates
+        return dict(_STATUS_RESPONSES.get(type(current_status), _PENDING_RESPONSE))
             
     except Exception as e:
         print(f"Error checking job status: {str(e)}")  # Debug log
         # If we can't get status, try the result method as fallback
         try:
-            result = fal_client.result(application,request_id)
+            result = await fal_async_client.result(application, request_id)
             return {
                 "status": "completed",
                 "result_url": result.get("images", [{}])[0].get("url") if result.get("images") else None,
@@ -1,22 +1,35 @@
-from typing import Optional, List
-from fastapi import FastAPI, Depends, Form, Query, UploadFile, File, HTTPException, status, BackgroundTasks
+from typing import Optional
+from fastapi import FastAPI, Depends, Form, Query, UploadFile, File, HTTPException, status, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager
 from app import models, database, schemas, utils, fal_api, auth
-from .utils import decode_token
+from .utils import decode_token_payload
+from .database import get_db
+from cachetools import TTLCache
+from datetime import datetime, timedelta, timezone
+import hashlib
 import io
+import logging
+import re
+import threading
+import time
 from PIL import Image
-import base64
 import asyncio
 
 # Setup OAuth2
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-# Initialize DB models
-models.Base.metadata.create_all(bind=database.engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Initialize DB models
+    await database.init_models()
+    yield
+    await database.engine.dispose()
 
-app = FastAPI(title="AI Image Editor API")
+app = FastAPI(title="AI Image Editor API", lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -30,17 +43,41 @@ app.add_middleware(
 # Include auth router
 app.include_router(auth.router)
 
-# Dependency: get DB session
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+class RedactWebhookToken(logging.Filter):
+    """
+    Keep the webhook secret in /api/jobs/callback?token=... out of uvicorn's access log
+    """
+    pattern = re.compile(r"(token=)[^&\s]+")
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.args, tuple):
+            record.args = tuple(
+                self.pattern.sub(r"\1***", arg) if isinstance(arg, str) else arg
+                for arg in record.args
+            )
+        return True
+
+logging.getLogger("uvicorn.access").addFilter(RedactWebhookToken())
+
+MAX_IMAGE_BYTES = 10 * 1024 * 1024  # 10MB upload limit
+UPLOAD_CHUNK_SIZE = 256 * 1024
+JOB_TIMEOUT_SECONDS = 600  # Stop waiting on a FAL job after 10 minutes
+DEDUP_WINDOW = timedelta(hours=1)  # Reuse a previous upload's FAL URL within this window
+
+# Resolved users keyed by raw token -> (user row, token exp timestamp)
+_user_cache = TTLCache(maxsize=10_000, ttl=60)
+_user_cache_lock = threading.Lock()
 
 # Dependency: get current user from JWT
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    email = decode_token(token)
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    with _user_cache_lock:
+        cached = _user_cache.get(token)
+    # The token's own exp bounds how long a cached entry may be used
+    if cached and cached[1] > time.time():
+        return cached[0]
+
+    payload = decode_token_payload(token)
+    email = payload.get("sub") if payload else None
     if not email:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -48,54 +85,43 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    user = db.query(models.User).filter(models.User.email == email).first()
+    # Only id/email are needed downstream - skip loading the password hash
+    user = (await db.execute(
+        select(models.User.id, models.User.email).where(models.User.email == email)
+    )).first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
 
+    with _user_cache_lock:
+        _user_cache[token] = (user, payload.get("exp", 0))
+
     return user
 
-# Background task to check job status periodically
-async def update_job_status(job_id: int, request_id: str, db: Session, application: str):
+# Background task to wait for a job result
+# Only used when FAL webhooks are not configured (see fal_api.WEBHOOK_BASE_URL)
+async def update_job_status(job_id: int, request_id: str, application: str):
     """
-    Background task to periodically check job status and update database
+    Background task that waits for the job to finish and stores its result
     """
-    max_attempts = 120  # Check for up to 10 minutes (5 seconds * 120)
-    attempt = 0
-    
-    while attempt < max_attempts:
-        try:
-            db = database.SessionLocal()
-            job = db.query(models.Job).filter(models.Job.id == job_id).first()
-            # Check job status
-            status_result = await fal_api.check_job_status(request_id, job.application)
-            print(f"Job {job_id} status: {status_result['status']}")  # Debug
-            
-            db = database.SessionLocal()
-            job = db.query(models.Job).filter(models.Job.id == job_id).first()
-            
-            if job:
-                job.status = status_result["status"]
-                
-                if status_result["status"] == "completed":
-                    job.result_url = status_result.get("result_url")
-                
-                db.commit()
-                
-                # If job is completed or failed, break the loop
-                if status_result["status"] in ["completed", "failed"]:
-                    print(f"Job {job_id} finished with status: {status_result['status']}")
-                    break
-            
-            db.close()
-            
-        except Exception as e:
-            print(f"Error updating job status: {e}")
-        
-        # Wait 5 seconds before checking again
-        await asyncio.sleep(5)
-        attempt += 1
-    
-    print(f"Stopped monitoring job {job_id} after {attempt} attempts")
+    try:
+        status_result = await asyncio.wait_for(
+            fal_api.wait_for_job(request_id, application), timeout=JOB_TIMEOUT_SECONDS
+        )
+    except asyncio.TimeoutError:
+        print(f"Stopped monitoring job {job_id} after {JOB_TIMEOUT_SECONDS} seconds")
+        return
+
+    try:
+        async with database.SessionLocal() as db:
+            await db.execute(
+                update(models.Job)
+                .where(models.Job.id == job_id)
+                .values(status=status_result["status"], result_url=status_result.get("result_url"))
+            )
+            await db.commit()
+        print(f"Job {job_id} finished with status: {status_result['status']}")
+    except Exception as e:
+        print(f"Error updating job status: {e}")
 
 @app.post("/api/jobs", response_model=schemas.BaseResponse[schemas.JobOut])
 async def create_job(
@@ -103,69 +129,93 @@ async def create_job(
     prompt: str = Form(..., description="Prompt for image generation or editing instructions"),
     image: Optional[UploadFile] = File(None, description="Optional image to edit (for image-to-image)"),
     strength: float = Form(0.7, description="How much to change the image (0-1) - only for image-to-image"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user=Depends(get_current_user),
 ):
     image_bytes = None
     image_url = None
+    content_hash = None
     
     # Process image if provided
     if image and image.filename:
         # Validate file type
         if not image.content_type.startswith('image/'):
-            return schemas.BaseResponse(
+            return schemas.BaseResponse.model_construct(
                 success=False,
                 message="File must be an image",
                 data=None
             )
         
-        image_bytes = await image.read()
-        
-        # Validate file size (e.g., 10MB max)
-        if len(image_bytes) > 10 * 1024 * 1024:
-            return schemas.BaseResponse(
-                success=False,
-                message="Image too large (max 10MB)",
-                data=None
-            )
+        # Read the upload in chunks and stop as soon as it exceeds the size limit
+        chunks = []
+        total_size = 0
+        while chunk := await image.read(UPLOAD_CHUNK_SIZE):
+            total_size += len(chunk)
+            if total_size > MAX_IMAGE_BYTES:
+                return schemas.BaseResponse.model_construct(
+                    success=False,
+                    message="Image too large (max 10MB)",
+                    data=None
+                )
+            chunks.append(chunk)
+        image_bytes = b"".join(chunks)
+        del chunks  # don't hold a second copy of the upload for the rest of the request
         
         # Validate image can be opened and get dimensions
         try:
-            pil_image = Image.open(io.BytesIO(image_bytes))
-            width, height = pil_image.size
+            # Image.open only parses the file header; size is read without
+            # decoding pixel data as long as load() is never called
+            with Image.open(io.BytesIO(image_bytes)) as pil_image:
+                width, height = pil_image.size
             
             # Validate image dimensions
             if width < 64 or height < 64:
-                return schemas.BaseResponse(
+                return schemas.BaseResponse.model_construct(
                     success=False,
                     message="Image too small (min 64x64 pixels)",
                     data=None
                 )
             if width > 4096 or height > 4096:
-                return schemas.BaseResponse(
+                return schemas.BaseResponse.model_construct(
                     success=False,
                     message="Image too large (max 4096x4096 pixels)",
                     data=None
                 )
                 
         except Exception as e:
-            return schemas.BaseResponse(
+            return schemas.BaseResponse.model_construct(
                 success=False,
                 message=f"Invalid image file: {str(e)}",
                 data=None
             )
         
-        # Store original image as base64
-        image_url = f"data:image/jpeg;base64,{base64.b64encode(image_bytes).decode('utf-8')}"
-
     try:
+        # Upload original image to FAL once and keep only its URL,
+        # reusing the URL if this user uploaded the same bytes recently
+        if image_bytes:
+            content_hash = hashlib.blake2b(image_bytes, digest_size=32).hexdigest()
+            image_url = await db.scalar(
+                select(models.Job.image_url)
+                .where(
+                    models.Job.owner_id == user.id,
+                    models.Job.content_hash == content_hash,
+                    models.Job.image_url.is_not(None),
+                    models.Job.created_at >= datetime.now(timezone.utc) - DEDUP_WINDOW,
+                )
+                .order_by(models.Job.id.desc())
+                .limit(1)
+            )
+            if not image_url:
+                image_url = await fal_api.upload_image(image_bytes, image.content_type)
+
         # Submit job to FAL AI - this returns immediately with request_id
-        fal_response = await fal_api.submit_fal_job(prompt, image_bytes)
+        fal_response = await fal_api.submit_fal_job(prompt, image_url)
 
         # Create job in database with pending status
         new_job = models.Job(
             prompt=prompt,
             image_url=image_url,  # Will be None for text-to-image
+            content_hash=content_hash,
             result_url=None,  # Will be updated when job completes
             fal_request_id=fal_response.get("request_id"),
             owner_id=user.id,
@@ -175,41 +225,77 @@ async def create_job(
         )
 
         db.add(new_job)
-        db.commit()
-        db.refresh(new_job)
+        await db.commit()
+        await db.refresh(new_job)
 
-        # Start background task to monitor job status
-        background_tasks.add_task(update_job_status, new_job.id, fal_response.get("request_id"), db, new_job.application)
+        # FAL calls /api/jobs/callback when the job finishes; poll only if webhooks are off
+        if not fal_response.get("webhook"):
+            background_tasks.add_task(update_job_status, new_job.id, fal_response.get("request_id"), new_job.application)
         
-        return schemas.BaseResponse(
+        return schemas.BaseResponse.model_construct(
             success=True,
             message="Job created successfully",
-            data=new_job
+            data=schemas.job_out(new_job)
         )
         
     except Exception as e:
-        return schemas.BaseResponse(
+        return schemas.BaseResponse.model_construct(
             success=False,
             message=f"Failed to create job: {str(e)}",
             data=None
         )
 
+@app.post("/api/jobs/callback", response_model=schemas.BaseResponse[dict])
+async def job_callback(
+    request: Request,
+    token: str = Query(..., description="Shared webhook secret"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Webhook called by FAL AI when a submitted job finishes
+    """
+    if not fal_api.verify_webhook_token(token):
+        raise HTTPException(status_code=401, detail="Invalid webhook token")
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body must be JSON")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Webhook body must be a JSON object")
+
+    request_id = payload.get("request_id")
+
+    job = await db.scalar(select(models.Job).where(models.Job.fal_request_id == request_id))
+    if not job:
+        # create_job commits the row after submitting, so a fast job can call back first.
+        # A non-2xx response makes FAL retry the webhook instead of dropping it.
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    status_result = fal_api.parse_webhook_result(payload)
+    job.status = status_result["status"]
+    job.result_url = status_result.get("result_url")
+    await db.commit()
+
+    return schemas.BaseResponse.model_construct(
+        success=True,
+        message="Job updated successfully",
+        data={"job_id": job.id, "status": job.status}
+    )
+
 @app.get("/api/jobs/{job_id}/status", response_model=schemas.BaseResponse[dict])
 async def check_job_status(
     job_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user=Depends(get_current_user)
 ):
     """
     Manually check the status of a specific job
     """
-    job = db.query(models.Job).filter(
-        models.Job.id == job_id, 
-        models.Job.owner_id == user.id
-    ).first()
+    job = await db.get(models.Job, job_id)
     
-    if not job:
-        return schemas.BaseResponse(
+    if not job or job.owner_id != user.id:
+        return schemas.BaseResponse.model_construct(
             success=False,
             message="Job not found",
             data=None
@@ -235,8 +321,8 @@ async def check_job_status(
             elif status_result["status"] == "processing":
                 job.status = "processing"
             
-            db.commit()
-            db.refresh(job)
+            await db.commit()
+            await db.refresh(job)
             
         except Exception as e:
             # If we can't check status, just return current DB status
@@ -253,60 +339,58 @@ async def check_job_status(
     if status_result and status_result.get("result_url") is not None:
         result_data["result_url"] = status_result.get("result_url")
 
-    return schemas.BaseResponse(
+    return schemas.BaseResponse.model_construct(
         success=True,
         message="Job status retrieved successfully",
         data=result_data
     )
 
-@app.get("/api/jobs", response_model=schemas.BaseResponse[List[schemas.JobOut]])
-def list_jobs(
-    page: int = Query(1, ge=1, description="Page number (starts from 1)"),
+@app.get("/api/jobs", response_model=schemas.BaseResponse[schemas.JobPage])
+async def list_jobs(
+    cursor: Optional[int] = Query(None, description="next_cursor from the previous page (omit for the first page)"),
     limit: int = Query(20, ge=1, le=100, description="Number of items per page (max 100)"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user=Depends(get_current_user)
 ):
     """
-    Get paginated list of jobs for the current user.
+    Get paginated list of jobs for the current user, newest first.
+    Uses keyset pagination on job id so deep pages cost the same as the first.
     """
-    skip = (page - 1) * limit
-    
-    jobs = db.query(models.Job)\
-        .filter(models.Job.owner_id == user.id)\
-        .order_by(models.Job.id.desc())\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
+    query = select(models.Job).where(models.Job.owner_id == user.id)
+    if cursor is not None:
+        query = query.where(models.Job.id < cursor)
+
+    jobs = (await db.scalars(query.order_by(models.Job.id.desc()).limit(limit))).all()
     
-    return schemas.BaseResponse(
+    return schemas.BaseResponse.model_construct(
         success=True,
         message="Jobs retrieved successfully",
-        data=jobs
+        data=schemas.JobPage.model_construct(
+            jobs=[schemas.job_out(job) for job in jobs],
+            next_cursor=jobs[-1].id if len(jobs) == limit else None
+        )
     )
 
 @app.get("/api/jobs/{job_id}", response_model=schemas.BaseResponse[schemas.JobOut])
-def get_job(job_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    job = db.query(models.Job).filter(
-        models.Job.id == job_id, 
-        models.Job.owner_id == user.id
-    ).first()
+async def get_job(job_id: int, db: AsyncSession = Depends(get_db), user=Depends(get_current_user)):
+    job = await db.get(models.Job, job_id)
     
-    if not job:
-        return schemas.BaseResponse(
+    if not job or job.owner_id != user.id:
+        return schemas.BaseResponse.model_construct(
             success=False,
             message="Job not found",
             data=None
         )
     
-    return schemas.BaseResponse(
+    return schemas.BaseResponse.model_construct(
         success=True,
         message="Job retrieved successfully",
-        data=job
+        data=schemas.job_out(job)
     )
 
 @app.get("/health", response_model=schemas.BaseResponse[dict])
 def health_check():
-    return schemas.BaseResponse(
+    return schemas.BaseResponse.model_construct(
         success=True,
         message="Service is healthy",
         data={"status": "healthy", "service": "AI Image Editor API"}
@@ -314,7 +398,7 @@ def health_check():
 
 @app.get("/", response_model=schemas.BaseResponse[dict])
 def read_root():
-    return schemas.BaseResponse(
+    return schemas.BaseResponse.model_construct(
         success=True,
         message="AI Image Editor API is running",
         data={"message": "AI Image Editor API is running"}
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Float, DateTime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Float, DateTime, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -15,12 +15,20 @@ class Job(Base):
     id = Column(Integer, primary_key=True, index=True)
     prompt = Column(Text)
     image_url = Column(String)
+    content_hash = Column(String, nullable=True)  # digest of the uploaded image bytes, for dedup
     result_url = Column(String, nullable=True)
     status = Column(String, default="pending")  # pending, processing, completed, failed
     application = Column(String, nullable=True)  # pending, processing, completed, failed
-    fal_request_id = Column(String, nullable=True)
+    fal_request_id = Column(String, nullable=True, index=True)  # webhook/poller lookups
     owner_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="jobs")  # lowercase 'r'
     strength = Column(Float, default=0.7)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    __table_args__ = (
+        # Serves "WHERE owner_id = ? ORDER BY id DESC" for job listing and owner-scoped lookups
+        Index("ix_jobs_owner_id_id_desc", owner_id, id.desc()),
+        # Finds a user's earlier upload of the same image
+        Index("ix_jobs_owner_id_content_hash", owner_id, content_hash),
+    )
\ No newline at end of file
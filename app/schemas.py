@@ -30,6 +30,14 @@ class JobOut(BaseModel):
     class Config:
         from_attributes = True
 
+def job_out(job) -> JobOut:
+    """Build a JobOut from a Job row we loaded ourselves, skipping re-validation"""
+    return JobOut.model_construct(**{name: getattr(job, name) for name in JobOut.model_fields})
+
+class JobPage(BaseModel):
+    jobs: List[JobOut]
+    next_cursor: Optional[int] = None  # pass as ?cursor= to fetch the next page
+
 # Auth response schemas
 class LoginResponseData(BaseModel):
     access_token: str
@@ -43,6 +51,6 @@ class RegisterResponseData(BaseModel):
 
 # Create specific response types
 JobResponse = BaseResponse[JobOut]
-JobListResponse = BaseResponse[List[JobOut]]
+JobListResponse = BaseResponse[JobPage]
 LoginResponse = BaseResponse[LoginResponseData]
 RegisterResponse = BaseResponse[RegisterResponseData]
\ No newline at end of file
@@ -1,35 +1,88 @@
-from passlib.context import CryptContext
+import bcrypt
 from jose import jwt, JWTError
-from datetime import datetime, timedelta
+from cachetools import TLRUCache
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
 import os
+import threading
+import time
 from dotenv import load_dotenv
 import re
 load_dotenv()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.getenv("JWT_SECRET")
 ALGORITHM = os.getenv("JWT_ALGORITHM")
+# bcrypt cost factor - 10 keeps a hash well under 100ms, raise it on faster hardware
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
+# Dedicated pool for CPU-bound bcrypt work so it doesn't block the event loop
+# or compete with FastAPI's default threadpool used for sync endpoints
+crypto_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="crypto")
 
 def hash_password(password: str):
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode("utf-8")
+
+def needs_rehash(hashed: str) -> bool:
+    """True if a stored "$2b$<cost>$..." hash was made with a cost other than BCRYPT_ROUNDS"""
+    try:
+        return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
 
 def verify_password(password: str, hashed: str):
-    return pwd_context.verify(password, hashed)
+    # checkpw compares in constant time and reads the cost from the stored hash,
+    # so hashes created with the old default cost still verify
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+    except ValueError:
+        return False
+
+JWT_REUSE_THRESHOLD = 60  # seconds of remaining lifetime required to reuse a token
+
+# Issued tokens keyed by (claims, expires_delta) -> (token, expiry timestamp).
+# Each entry drops out JWT_REUSE_THRESHOLD seconds before its token expires.
+_JWT_CACHE = TLRUCache(
+    maxsize=10_000,
+    ttu=lambda _key, value, _now: value[1] - JWT_REUSE_THRESHOLD,
+    timer=time.time,
+)
+_JWT_CACHE_LOCK = threading.Lock()
+
+def create_access_token(data: dict, expires_delta: timedelta = timedelta(days=100), force_new: bool = False):
+    """
+    Return a signed JWT for the given claims, reusing a previously issued one
+    while it still has more than JWT_REUSE_THRESHOLD seconds left.
+    Pass force_new=True to always sign a fresh token (e.g. after a password change).
+    """
+    cache_key = (tuple(sorted(data.items())), expires_delta)
+    now = time.time()
+
+    if not force_new:
+        with _JWT_CACHE_LOCK:
+            cached = _JWT_CACHE.get(cache_key)
+        if cached:
+            return cached[0]
 
-def create_access_token(data: dict, expires_delta: timedelta = timedelta(days=100)):
     to_encode = data.copy()
-    expire = datetime.utcnow() + expires_delta
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    expire = now + expires_delta.total_seconds()
+    to_encode.update({"exp": int(expire)})
+    token = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def decode_token(token: str):
+    with _JWT_CACHE_LOCK:
+        _JWT_CACHE[cache_key] = (token, expire)
+    return token
+
+def decode_token_payload(token: str):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload.get("sub")
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         return None
 
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+MAX_EMAIL_LENGTH = 320
+
 def is_valid_email(email: str) -> bool:
     """Validate email format"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
\ No newline at end of file
+    # Cheap checks first so obvious garbage never reaches the regex engine
+    if len(email) > MAX_EMAIL_LENGTH or "@" not in email:
+        return False
+    return EMAIL_PATTERN.match(email) is not None
\ No newline at end of file